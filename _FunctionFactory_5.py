@@ -1,10 +1,14 @@
-import autogen
 import PyPDF2 
 from pydantic import BaseModel, Field
 from typing_extensions import Annotated
 import os
 from dotenv import load_dotenv  
 
+import _OutputSink_5
+import _RateLimiter_5
+import _Transport_5
+from _ToolExecutor_5 import execution
+
 
 # wrapper function to add description to the function
 # syntax ref: https://stackoverflow.com/questions/47056059/best-way-to-add-attributes-to-a-python-function
@@ -14,10 +18,14 @@ def desc(desc):
         return f
     return wrapper
 
+# use the execution decorator to run a function in a thread or in the process pool instead of the agent thread,
+# e.g. @execution("process", timeout=120) for CPU heavy functions. see _ToolExecutor_5.py
+
 # define custom functions:
 
 
 @desc("read the content of a file")
+@execution("process", timeout=120)
 def read_file(file_path: Annotated[str, "Name and path of file to read."]) -> Annotated[str, "file content"]:
     """
     args:
@@ -55,11 +63,15 @@ def read_file(file_path: Annotated[str, "Name and path of file to read."]) -> An
 @desc("save the content to a file")
 def save_to_file(file_path: Annotated[str, "full path to the file"], content: Annotated[str, "content"]) -> Annotated[str, "status: success or error"]:
     """
+    queue the content to be written to the file by the background output sink and return immediately.
+    the file is replaced atomically, and gzip compressed when the path ends with .gz.
+
     args:
         file_path (str): the path to the file.
+        content (str): the content to save.
 
     returns:
-        none.
+        str: success and the write id to check with check_file_save_status, or error.
         
     raises:
         none.
@@ -67,10 +79,31 @@ def save_to_file(file_path: Annotated[str, "full path to the file"], content: An
     
     print(f"writing file to {file_path}")
     
-    with open(file_path, "w") as f:
-        f.write(content)
+    try:
+        handle = _OutputSink_5.get_sink().submit(file_path, content)
+    except Exception as e:
+        return f"error: {e}"
         
-    return "success"
+    return f"success: write id {handle.write_id} queued for {handle.file_path}"
+
+@desc("check the status of a file save")
+def check_file_save_status(write_id: Annotated[str, "write id returned by save_to_file"], wait_seconds: Annotated[float, "seconds to wait for the write to finish"] = 0) -> Annotated[str, "status: queued, written, superseded or error"]:
+    """
+    args:
+        write_id (str): the write id returned by save_to_file, e.g. w1
+        wait_seconds (float): how long to wait for the write to finish, 0 to just poll.
+
+    returns:
+        str: the status of the write.
+    """
+    print(f"check_file_save_status({write_id})")
+
+    handle = _OutputSink_5.get_sink().get_handle(write_id)
+    if handle is None:
+        return f"error: unknown write id {write_id}"
+    if wait_seconds:
+        handle.wait(wait_seconds)
+    return str(handle)
 
 
 # for now we expect the model to return this array of function names
@@ -100,6 +133,7 @@ def get_health_insurance_policy(account: Annotated[str,"account number"]) -> Ann
     return "P56789"
 
 @desc("get the policy benefits of a user.")
+@execution("process", timeout=120)
 def get_policy_benefits(policy: Annotated[str,"policy number"]) -> Annotated[str,"benefits details"]:
     """
     Args:
@@ -151,6 +185,7 @@ def find_careproviders(provider_type: Annotated[str, "type of care provider"], l
 
 
 @desc("analyze the sentiment of a text")
+@execution("thread", timeout=180)
 def analyze_sentiment(text: Annotated[str, "text to analyze"]) -> Annotated[str, "sentiment"]:
     """
     Args:
@@ -161,6 +196,9 @@ def analyze_sentiment(text: Annotated[str, "text to analyze"]) -> Annotated[str,
     """
     print(f"sentiment_analysis({text})")
     
+    # imported here so process pool workers, which only need the file functions, stay light
+    import autogen
+    
     load_dotenv()  
 
     config_list = [{
@@ -169,7 +207,9 @@ def analyze_sentiment(text: Annotated[str, "text to analyze"]) -> Annotated[str,
         'base_url': os.getenv("AZURE_OPENAI_ENDPOINT"), 
         'api_type': 'azure', 
         'api_version': os.getenv("AZURE_OPENAI_API_VERSION"),
-        'tags': ["tool", "gpt-4"]
+        'tags': ["tool", "gpt-4"],
+        'http_client': _Transport_5.http_client,
+        'max_retries': 0,
         }]
 
 
@@ -185,16 +225,21 @@ def analyze_sentiment(text: Annotated[str, "text to analyze"]) -> Annotated[str,
         system_message="you are a helpful assistant"
     )
 
+    # count the call against the batch runner's rpm/tpm quota when one is set
+    limit = _RateLimiter_5.limit_agent(assistant)
+
     reply = assistant.generate_reply(messages=[{"content": text, "role": "user"}])
+    if limit is not None:
+        limit.reconcile()
     return reply
 
 
 # a function to ask a question and get an answer using prompty as an experiment
-from promptflow.core import Prompty
 from pathlib import Path
 BASE_DIR = Path(__file__).absolute().parent
 
 @desc("ask a question and get an answer")
+@execution("thread", timeout=180)
 def ask_a_question(question: Annotated[str, "question to ask"]) -> Annotated[str, "answer to the question"]:
     """
     Args:
@@ -208,6 +253,9 @@ def ask_a_question(question: Annotated[str, "question to ask"]) -> Annotated[str
         # load environment variables from .env file
         load_dotenv()
 
+    # imported here so process pool workers, which only need the file functions, stay light
+    from promptflow.core import Prompty
+
     prompty = Prompty.load(source=BASE_DIR / "chat.prompty")
     output = prompty(question=question)
     return output
@@ -228,4 +276,5 @@ functions_table =  [
     {"id": "7","func": find_careproviders },
     {"id": "8","func": analyze_sentiment },
     {"id": "9","func": ask_a_question},
+    {"id": "10","func": check_file_save_status},
 ]
@@ -0,0 +1,257 @@
+import atexit
+import gzip
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+# the umask can only be read by setting it, do it once at import
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+# write-behind output sink used by save_to_file.
+# writes are queued and committed by a background thread so the agent turn does not block on disk IO.
+# each commit writes to a temp file in the target directory and then renames it over the target,
+# so readers (and other sessions writing the same path) never see a partially written file.
+
+
+class WriteHandle:
+    """
+    handle for a queued write. the agent can poll it with done()/status or block on it with wait().
+    """
+
+    def __init__(self, write_id: str, file_path: str):
+        self.write_id = write_id
+        self.file_path = file_path
+        self.status = "queued"          # queued -> written | superseded | error
+        self.error: Optional[str] = None
+        self.bytes_written = 0
+        self.queued_at = time.time()
+        self.completed_at: Optional[float] = None
+        self._event = threading.Event()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        block until the write is committed or failed.
+
+        args:
+            timeout (float): seconds to wait, None waits forever.
+
+        returns:
+            bool: True if the write finished (successfully or not) within the timeout.
+        """
+        return self._event.wait(timeout)
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.completed_at = time.time()
+        self._event.set()
+
+    def __str__(self):
+        if self.error:
+            return f"{self.write_id}: {self.status} ({self.file_path}): {self.error}"
+        return f"{self.write_id}: {self.status} ({self.file_path})"
+
+
+class _WriteRequest:
+    __slots__ = ("handle", "content", "compress")
+
+    def __init__(self, handle: WriteHandle, content: str, compress: bool):
+        self.handle = handle
+        self.content = content
+        self.compress = compress
+
+
+class OutputSink:
+    """
+    background, atomic, batched file writer.
+
+    args:
+        max_queue (int): maximum number of pending writes. when the queue is full, submit() blocks
+            for up to put_timeout seconds (back-pressure) and then raises queue.Full.
+        batch_size (int): maximum number of queued writes the writer drains per batch. writes to the
+            same path within a batch are coalesced; only the last one is committed since each write
+            replaces the whole file.
+        fsync (bool): fsync the temp file before renaming it over the target.
+        put_timeout (float): seconds submit() waits for queue space.
+    """
+
+    def __init__(self, max_queue: int = 256, batch_size: int = 32, fsync: bool = True, put_timeout: float = 30):
+        self._queue: "queue.Queue[Optional[_WriteRequest]]" = queue.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._fsync = fsync
+        self._put_timeout = put_timeout
+        self._handles: Dict[str, WriteHandle] = {}
+        self._max_handles = 1024
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="output-sink-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, file_path: str, content: str, compress: Optional[bool] = None) -> WriteHandle:
+        """
+        queue content to be written to file_path and return immediately.
+
+        args:
+            file_path (str): the path to the file.
+            content (str): the content to write.
+            compress (bool): gzip the content. defaults to True when file_path ends with .gz.
+
+        returns:
+            WriteHandle: handle to poll or wait on.
+
+        raises:
+            RuntimeError: if the sink is closed.
+            FileNotFoundError: if the directory of the file does not exist.
+            PermissionError: if the directory of the file is not writable.
+            queue.Full: if the queue stays full for put_timeout seconds.
+        """
+        if self._closed:
+            raise RuntimeError("output sink is closed")
+        if compress is None:
+            compress = file_path.endswith(".gz")
+
+        # fail now, while the agent can still see the error, for the problems we can detect up front
+        file_path = os.path.abspath(file_path)
+        directory = os.path.dirname(file_path)
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"directory does not exist: {directory}")
+        if not os.access(directory, os.W_OK):
+            raise PermissionError(f"directory is not writable: {directory}")
+
+        handle = WriteHandle(f"w{next(self._ids)}", file_path)
+        with self._lock:
+            # forget finished writes once the table gets large so long running processes do not grow
+            if len(self._handles) >= self._max_handles:
+                for write_id in [k for k, h in self._handles.items() if h.done()]:
+                    del self._handles[write_id]
+            self._handles[handle.write_id] = handle
+        try:
+            self._queue.put(_WriteRequest(handle, content, compress), timeout=self._put_timeout)
+        except queue.Full:
+            with self._lock:
+                del self._handles[handle.write_id]
+            raise
+        return handle
+
+    def get_handle(self, write_id: str) -> Optional[WriteHandle]:
+        with self._lock:
+            return self._handles.get(write_id)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        wait for every write queued so far to finish.
+
+        returns:
+            bool: True if all pending writes finished within the timeout.
+        """
+        with self._lock:
+            pending = [h for h in self._handles.values() if not h.done()]
+        deadline = None if timeout is None else time.time() + timeout
+        for handle in pending:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not handle.wait(remaining):
+                return False
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        stop accepting writes, commit everything still queued and stop the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch: List[_WriteRequest] = []
+            item = self._queue.get()
+            stop = item is None
+            if item is not None:
+                batch.append(item)
+            # drain whatever else is already waiting, up to batch_size
+            while not stop and len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch: List[_WriteRequest]):
+        # keep queue order per path; only the last write to each path needs to hit the disk
+        latest: Dict[str, _WriteRequest] = {}
+        for request in batch:
+            previous = latest.get(request.handle.file_path)
+            if previous is not None:
+                previous.handle._finish("superseded")
+            latest[request.handle.file_path] = request
+
+        for request in latest.values():
+            try:
+                request.handle.bytes_written = self._write_atomic(request)
+                request.handle._finish("written")
+            except Exception as e:
+                request.handle._finish("error", str(e))
+                print(f"save_to_file error: {request.handle}")
+
+    def _write_atomic(self, request: _WriteRequest) -> int:
+        file_path = request.handle.file_path
+        data = request.content.encode("utf-8")
+        if request.compress:
+            data = gzip.compress(data)
+
+        directory = os.path.dirname(file_path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(file_path))
+        try:
+            # mkstemp creates the file as 0600; keep the mode of the file being replaced, or the mode
+            # open(file_path, "w") would have given a new file
+            try:
+                mode = os.stat(file_path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~_umask
+            os.chmod(tmp_path, mode)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                if self._fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return len(data)
+
+
+# process wide sink shared by all sessions
+_sink: Optional[OutputSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_sink() -> OutputSink:
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = OutputSink()
+            # commit anything still queued when the interpreter exits
+            atexit.register(_sink.close)
+        return _sink
@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    thread safe token bucket refilled continuously at rate_per_minute.
+
+    args:
+        rate_per_minute (float): tokens added per minute.
+        capacity (float): maximum burst size, defaults to one minute worth of tokens.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        take amount tokens, waiting until they are available. an amount larger than the capacity is capped
+        at the capacity so a single large request can still go through.
+
+        returns:
+            bool: False if the tokens were not available within the timeout.
+        """
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def debit(self, amount: float):
+        """
+        take tokens without waiting, e.g. to correct an estimate once the real usage is known.
+        the balance may go negative, which delays the next acquire.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+
+class RateLimiter:
+    """
+    requests per minute and tokens per minute limits of an azure openai deployment.
+
+    args:
+        rpm (float): requests per minute, None for no limit.
+        tpm (float): tokens per minute, None for no limit.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, estimated_tokens: int = 0):
+        """
+        wait until one request with estimated_tokens tokens can be sent.
+        """
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and estimated_tokens:
+            self.tokens.acquire(estimated_tokens)
+
+    def record(self, estimated_tokens: int, actual_tokens: int):
+        """
+        correct the token bucket once the actual usage of a request is known.
+        """
+        if self.tokens is not None:
+            self.tokens.debit(actual_tokens - estimated_tokens)
+
+
+def estimate_tokens(messages, tools=None) -> int:
+    """
+    rough token count of a chat completion request, about 4 characters per token.
+
+    args:
+        messages (list): the messages sent, including the system message.
+        tools (list): the tools schema sent with the request.
+    """
+    chars = 0
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        for tool_call in message.get("tool_calls") or []:
+            chars += len(json.dumps(tool_call))
+    if tools:
+        chars += len(json.dumps(tools))
+    return chars // 4 + 4 * len(messages)
+
+
+def _used_tokens(agent) -> int:
+    # tokens the agent's current openai client has used, cached replies excluded
+    summary = getattr(agent.client, "actual_usage_summary", None) or {}
+    return sum(value.get("total_tokens", 0) for value in summary.values() if isinstance(value, dict))
+
+
+class AgentRateLimit:
+    """
+    applies a RateLimiter to every LLM call of an autogen agent. the estimate covers the agent's system message,
+    the chat messages and the tools schema. it is corrected with the actual usage of each reply when the agent
+    sends the reply, or when reconcile() is called for agents used through generate_reply.
+
+    args:
+        limiter (RateLimiter): the limiter.
+        agent (autogen.ConversableAgent): the agent to limit.
+    """
+
+    def __init__(self, limiter: RateLimiter, agent):
+        self.limiter = limiter
+        self.agent = agent
+        self.replies = 0
+        self._estimate: Optional[int] = None
+        self._used_before = 0
+        agent.register_hook("process_all_messages_before_reply", self._before_reply)
+        agent.register_hook("process_message_before_send", self._before_send)
+
+    def _before_reply(self, messages):
+        self.reconcile()
+        llm_config = self.agent.llm_config or {}
+        tokens = estimate_tokens(list(self.agent._oai_system_message) + list(messages), llm_config.get("tools"))
+        self.limiter.acquire(tokens)
+        self._estimate = tokens
+        self._used_before = _used_tokens(self.agent)
+        return messages
+
+    def _before_send(self, sender, message, recipient, silent):
+        self.reconcile()
+        self.replies += 1
+        return message
+
+    def reconcile(self):
+        """
+        correct the limiter with the actual usage of the last reply.
+        """
+        if self._estimate is None:
+            return
+        used = _used_tokens(self.agent) - self._used_before
+        # a negative delta means the agent's client was replaced; keep the estimate then
+        if used >= 0:
+            self.limiter.record(self._estimate, used)
+        self._estimate = None
+
+
+# limiter for LLM calls made inside tools, e.g. analyze_sentiment. set by the batch runner
+shared_limiter: Optional[RateLimiter] = None
+
+
+def limit_agent(agent, limiter: Optional[RateLimiter] = None) -> Optional[AgentRateLimit]:
+    """
+    apply limiter, or the shared limiter, to the agent.
+
+    returns:
+        AgentRateLimit: the applied limit, None when there is no limiter.
+    """
+    limiter = limiter or shared_limiter
+    if limiter is None:
+        return None
+    return AgentRateLimit(limiter, agent)
@@ -0,0 +1,279 @@
+import hashlib
+import sys
+import threading
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
+
+# compact per session chat state.
+# messages are kept as __slots__ records instead of dicts / SDK objects, role and name strings are interned,
+# and large contents (e.g. pdf text returned by read_file) go into a process wide content addressed blob store,
+# so the same payload is stored once no matter how many sessions hold it.
+# for the autogen engine, AgentBlobRefs swaps large tool outputs in the agents' chat history for blob references
+# and expands them again only for the LLM request.
+
+
+class BlobStore:
+    """
+    content addressed, reference counted store for large message contents.
+    """
+
+    def __init__(self):
+        self._blobs: Dict[str, str] = {}
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def put(self, content: str) -> str:
+        """
+        args:
+            content (str): the content to store.
+
+        returns:
+            str: the blob id, the sha256 of the content.
+        """
+        blob_id = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        with self._lock:
+            if blob_id in self._blobs:
+                self._refs[blob_id] += 1
+            else:
+                self._blobs[blob_id] = content
+                self._refs[blob_id] = 1
+        return blob_id
+
+    def get(self, blob_id: str) -> str:
+        return self._blobs[blob_id]
+
+    def release(self, blob_id: str):
+        with self._lock:
+            self._refs[blob_id] -= 1
+            if self._refs[blob_id] == 0:
+                del self._refs[blob_id]
+                del self._blobs[blob_id]
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def size(self) -> int:
+        """
+        returns:
+            int: total characters stored.
+        """
+        with self._lock:
+            return sum(len(content) for content in self._blobs.values())
+
+
+# process wide store shared by all sessions
+blob_store = BlobStore()
+
+# contents at least this long are stored in the blob store
+BLOB_THRESHOLD = 512
+
+
+class ToolCall:
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id: str, name: str, arguments: str):
+        self.id = id
+        self.name = sys.intern(name)
+        self.arguments = arguments
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "type": "function", "function": {"name": self.name, "arguments": self.arguments}}
+
+
+class Message:
+    __slots__ = ("role", "name", "tool_call_id", "tool_calls", "_content", "_blob_id")
+
+    def __init__(self, role: str, content: Optional[str] = None, name: Optional[str] = None,
+                 tool_call_id: Optional[str] = None, tool_calls: Optional[Tuple[ToolCall, ...]] = None):
+        self.role = sys.intern(role)
+        self.name = sys.intern(name) if name else None
+        self.tool_call_id = tool_call_id
+        self.tool_calls = tool_calls
+        if content is not None and len(content) >= BLOB_THRESHOLD:
+            self._content = None
+            self._blob_id = blob_store.put(content)
+        else:
+            self._content = content
+            self._blob_id = None
+
+    @property
+    def content(self) -> Optional[str]:
+        if self._blob_id is not None:
+            return blob_store.get(self._blob_id)
+        return self._content
+
+    @property
+    def blob_id(self) -> Optional[str]:
+        return self._blob_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        returns:
+            dict: the message in the chat completion api format.
+        """
+        message = {"role": self.role, "content": self.content}
+        if self.name:
+            message["name"] = self.name
+        if self.tool_call_id:
+            message["tool_call_id"] = self.tool_call_id
+        if self.tool_calls:
+            message["tool_calls"] = [tool_call.to_dict() for tool_call in self.tool_calls]
+        return message
+
+
+class Session:
+    """
+    chat history of one session.
+    """
+    __slots__ = ("session_id", "messages")
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id
+        self.messages: List[Message] = []
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Any], session_id: Optional[str] = None) -> "Session":
+        session = cls(session_id)
+        for message in messages:
+            session.add_message(message)
+        return session
+
+    def add(self, role: str, content: Optional[str], name: Optional[str] = None, tool_call_id: Optional[str] = None):
+        self.messages.append(Message(role, content, name=name, tool_call_id=tool_call_id))
+
+    def add_message(self, message: Any):
+        """
+        add a message given as a dict or as an openai SDK message object. only the fields the chat completion
+        api needs are kept, the SDK object itself is not referenced.
+        """
+        get = message.get if isinstance(message, dict) else lambda key: getattr(message, key, None)
+        tool_calls = None
+        if get("tool_calls"):
+            tool_calls = tuple(_tool_call(tool_call) for tool_call in get("tool_calls"))
+        content = get("content")
+        self.messages.append(Message(
+            get("role"),
+            content if content is None else str(content),
+            name=get("name"),
+            tool_call_id=get("tool_call_id"),
+            tool_calls=tool_calls,
+        ))
+
+    def add_tool_result(self, tool_call_id: str, name: str, content: Any):
+        self.add("tool", str(content), name=name, tool_call_id=tool_call_id)
+
+    def to_openai(self) -> List[Dict[str, Any]]:
+        """
+        returns:
+            list: the messages in the chat completion api format.
+        """
+        return [message.to_dict() for message in self.messages]
+
+    def clear(self):
+        """
+        drop the history and release its blobs.
+        """
+        for message in self.messages:
+            if message.blob_id is not None:
+                blob_store.release(message.blob_id)
+        self.messages = []
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __del__(self):
+        # the blob store may already be gone at interpreter shutdown
+        if blob_store is not None:
+            self.clear()
+
+
+def _tool_call(tool_call: Any) -> ToolCall:
+    if isinstance(tool_call, dict):
+        return ToolCall(tool_call["id"], tool_call["function"]["name"], tool_call["function"]["arguments"])
+    return ToolCall(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+
+
+# autogen chat history keeps one message dict per agent. tool outputs are replaced by this prefix and the blob id
+BLOB_REF_PREFIX = "blob:"
+
+
+def expand_blob_refs(message: Any, blob_ids: Collection[str]) -> Any:
+    """
+    args:
+        message: a chat message. only tool response messages carry blob references.
+        blob_ids (Collection[str]): ids of the blobs whose references are expanded. any other content, e.g. user
+            text that happens to start with the prefix, is left as is.
+
+    returns:
+        the message with blob references replaced by their content. messages without references are returned as is.
+    """
+    if not isinstance(message, dict) or not message.get("tool_responses"):
+        return message
+    content = message.get("content")
+    responses = message["tool_responses"]
+    if not _is_blob_ref(content, blob_ids) and not any(_is_blob_ref(response.get("content"), blob_ids) for response in responses):
+        return message
+    message = dict(message)
+    message["content"] = _expand(content, blob_ids)
+    message["tool_responses"] = [dict(response, content=_expand(response.get("content"), blob_ids)) for response in responses]
+    return message
+
+
+def _is_blob_ref(content: Any, blob_ids: Collection[str]) -> bool:
+    return isinstance(content, str) and content.startswith(BLOB_REF_PREFIX) and content[len(BLOB_REF_PREFIX):] in blob_ids
+
+
+def _expand(content: Any, blob_ids: Collection[str]) -> Any:
+    if _is_blob_ref(content, blob_ids):
+        return blob_store.get(content[len(BLOB_REF_PREFIX):])
+    return content
+
+
+class AgentBlobRefs:
+    """
+    keeps large tool outputs of an autogen chat in the blob store. tool response messages sent by the user proxy
+    are stored with blob references in both agents' history, and the assistant expands the references only for
+    the messages it sends to the LLM. only references this instance issued are expanded.
+
+    the hook runs before autogen prints and stores the message, so the console and chat_result.chat_history show
+    the tool outputs as blob:<sha256> references. use expand_blob_refs(message, blob_refs.blob_ids) to read them
+    before release().
+
+    args:
+        user_proxy (autogen.UserProxyAgent): the agent executing the tools.
+        assistant (autogen.AssistantAgent): the agent calling the LLM.
+    """
+    __slots__ = ("blob_ids",)
+
+    def __init__(self, user_proxy, assistant):
+        self.blob_ids: List[str] = []
+        user_proxy.register_hook("process_message_before_send", self._before_send)
+        assistant.register_hook("process_all_messages_before_reply", self._before_reply)
+
+    def _ref(self, content: Any) -> Any:
+        if not isinstance(content, str) or len(content) < BLOB_THRESHOLD:
+            return content
+        blob_id = blob_store.put(content)
+        self.blob_ids.append(blob_id)
+        return BLOB_REF_PREFIX + blob_id
+
+    def _before_send(self, sender, message, recipient, silent):
+        if not isinstance(message, dict) or not message.get("tool_responses"):
+            return message
+        message = dict(message)
+        message["tool_responses"] = [dict(response, content=self._ref(response.get("content")))
+                                     for response in message["tool_responses"]]
+        message["content"] = self._ref(message.get("content"))
+        return message
+
+    def _before_reply(self, messages):
+        blob_ids = set(self.blob_ids)
+        return [expand_blob_refs(message, blob_ids) for message in messages]
+
+    def release(self):
+        """
+        release the blobs of the chat, call when the agents' history is cleared or dropped.
+        """
+        for blob_id in self.blob_ids:
+            blob_store.release(blob_id)
+        self.blob_ids = []
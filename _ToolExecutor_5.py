@@ -0,0 +1,238 @@
+import concurrent.futures
+import functools
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+
+# execution classes a tool can declare with the execution decorator:
+#   inline:  run in the calling (agent) thread. default for cheap tools.
+#   thread:  run in a shared thread pool. for IO bound tools, e.g. tools that call an LLM.
+#   process: run in a warm process pool. for CPU bound tools, e.g. PDF parsing, so a slow document
+#            does not hold the GIL for every other session in the process.
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+
+
+def execution(kind: str, timeout: Optional[float] = None):
+    """
+    decorator to declare how a tool is executed, same style as the desc decorator.
+
+    args:
+        kind (str): inline, thread or process.
+        timeout (float): per call timeout in seconds, None for no timeout. not enforced for inline tools.
+    """
+    if kind not in (INLINE, THREAD, PROCESS):
+        raise ValueError(f"unknown execution class: {kind}")
+
+    def wrapper(f):
+        f.__execution__ = kind
+        f.__timeout__ = timeout
+        return f
+    return wrapper
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class ToolExecutor:
+    """
+    runs tools according to their declared execution class.
+
+    args:
+        thread_workers (int): size of the thread pool.
+        process_workers (int): size of the process pool.
+        max_tasks_per_worker (int): number of tasks after which a process worker is replaced by a fresh one,
+            to limit memory growth from large documents.
+    """
+
+    def __init__(self, thread_workers: int = 8, process_workers: int = 2, max_tasks_per_worker: int = 50):
+        self._thread_workers = thread_workers
+        self._process_workers = process_workers
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        # pools this executor terminated itself to stop a timed out call. calls that were running or queued
+        # next to it fail with BrokenProcessPool or CancelledError through no fault of their own and are
+        # resubmitted by call()
+        self._recycled = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self._thread_workers, thread_name_prefix="tool")
+            return self._threads
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                # max_tasks_per_child uses the spawn start method, so workers import the tool modules fresh
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self._process_workers,
+                    max_tasks_per_child=self._max_tasks_per_worker,
+                )
+                # start the workers now rather than on the first tool call
+                for _ in range(self._process_workers):
+                    self._processes.submit(_warm_up)
+            return self._processes
+
+    def warm_up(self):
+        """
+        start the process pool workers ahead of the first process tool call.
+        """
+        self._process_pool()
+
+    def submit(self, func: Callable[..., Any], kwargs: Dict[str, Any]) -> concurrent.futures.Future:
+        """
+        start the tool call and return a future. cancel it with cancel().
+
+        args:
+            func (Callable): the tool function.
+            kwargs (dict): the tool arguments.
+
+        returns:
+            Future: the future of the tool result.
+        """
+        kind = getattr(func, "__execution__", INLINE)
+        if kind == PROCESS:
+            return self._submit_process(func, kwargs)[0]
+        if kind == THREAD:
+            return self._thread_pool().submit(func, **kwargs)
+
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(func(**kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def _submit_process(self, func: Callable[..., Any], kwargs: Dict[str, Any]):
+        # returns the future and the pool it was submitted to
+        while True:
+            pool = self._process_pool()
+            try:
+                return pool.submit(func, **kwargs), pool
+            except BrokenProcessPool:
+                # a worker died, e.g. killed by the OS; start a fresh pool
+                self._reset_process_pool(pool)
+            except RuntimeError:
+                # "cannot schedule new futures after shutdown": another call recycled the pool in between
+                if pool not in self._recycled:
+                    raise
+
+    def call(self, func: Callable[..., Any], kwargs: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """
+        run the tool and wait for the result.
+
+        args:
+            func (Callable): the tool function.
+            kwargs (dict): the tool arguments.
+            timeout (float): overrides the timeout declared on the tool.
+
+        returns:
+            Any: the tool result.
+
+        raises:
+            TimeoutError: if the tool does not finish in time. the call is cancelled.
+            BrokenProcessPool: if a process tool's worker died for a reason other than a recycle started by
+                this executor.
+            CancelledError: if the call was cancelled for a reason other than such a recycle.
+        """
+        if timeout is None:
+            timeout = getattr(func, "__timeout__", None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        if getattr(func, "__execution__", INLINE) != PROCESS:
+            future = self.submit(func, kwargs)
+            try:
+                return future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                self.cancel(future)
+                raise TimeoutError(f"{func.__name__} did not finish within {timeout} seconds")
+
+        while True:
+            future, pool = self._submit_process(func, kwargs)
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                return future.result(remaining)
+            except concurrent.futures.TimeoutError:
+                self.cancel(future)
+                raise TimeoutError(f"{func.__name__} did not finish within {timeout} seconds")
+            except (BrokenProcessPool, concurrent.futures.CancelledError):
+                # another call timed out and its pool was recycled, which breaks the running calls and cancels
+                # the queued ones; run this call again in the new pool
+                if pool not in self._recycled:
+                    raise
+
+    def cancel(self, future: concurrent.futures.Future) -> bool:
+        """
+        cancel a tool call. a call that has not started is simply dropped. a running process call can only be
+        stopped by terminating its worker, so the process pool is recycled; other calls made with call() that
+        were running or queued in it are resubmitted to the new pool, calls made with submit() fail with
+        BrokenProcessPool or CancelledError.
+        a running thread call cannot be stopped and is left to finish in the background.
+
+        returns:
+            bool: True if the call was cancelled or its worker was terminated.
+        """
+        if future.cancel():
+            return True
+        if future.done():
+            return False
+        with self._lock:
+            pool = self._processes
+        if pool is not None and self._is_process_future(pool, future):
+            self._reset_process_pool(pool, recycled=True)
+            return True
+        return False
+
+    @staticmethod
+    def _is_process_future(pool: ProcessPoolExecutor, future: concurrent.futures.Future) -> bool:
+        return any(item.future is future for item in list(pool._pending_work_items.values()))
+
+    def _reset_process_pool(self, pool: ProcessPoolExecutor, recycled: bool = False):
+        with self._lock:
+            if self._processes is pool:
+                self._processes = None
+            # mark the pool before terminating it so the calls it breaks know to resubmit
+            if recycled:
+                self._recycled.add(pool)
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        wrap a tool so calling it goes through the executor. the wrapper keeps the name, signature and
+        description of the tool so it can be registered with the agents as is.
+        """
+        if getattr(func, "__execution__", INLINE) == INLINE:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(**kwargs):
+            return self.call(func, kwargs)
+        # the wrapper itself runs inline and dispatches the wrapped tool
+        wrapper.__execution__ = INLINE
+        return wrapper
+
+    def shutdown(self):
+        with self._lock:
+            threads, self._threads = self._threads, None
+            processes, self._processes = self._processes, None
+        if threads is not None:
+            threads.shutdown(wait=False, cancel_futures=True)
+        if processes is not None:
+            processes.shutdown(wait=False, cancel_futures=True)
+
+
+# process wide executor shared by all sessions
+tool_executor = ToolExecutor()
@@ -0,0 +1,262 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+
+# shared http transport for all LLM traffic: the autogen agents, the AzureOpenAI client in function_calling.py
+# and the agent in analyze_sentiment. pass http_client to the openai client (or to the autogen config_list)
+# together with max_retries=0 so retries are done here, once, for every caller.
+#
+# the transport provides:
+#   - one keep-alive connection pool
+#   - retries with exponential backoff and jitter, honoring retry-after-ms / retry-after on 429 and 503
+#   - hedging: a non streaming chat completion still running after hedge_after seconds is sent again and the
+#     first response wins. off by default since the duplicate request costs tokens. other requests, e.g.
+#     assistants api POSTs that create threads or runs, are never hedged since sending them twice is not safe
+#   - a concurrency cap per azure deployment shared by every caller in the process
+
+
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError)
+
+_deployment = re.compile(r"/deployments/([^/]+)/")
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    # releases the deployment slot when a streamed response is closed
+    def __init__(self, stream: httpx.SyncByteStream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release_once()
+
+    def _release_once(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __del__(self):
+        # safety net for callers that never close the response, a leaked slot would shrink the cap for good
+        self._release_once()
+
+
+class LLMTransport(httpx.BaseTransport):
+    """
+    args:
+        max_connections (int): maximum open connections in the pool.
+        max_keepalive_connections (int): idle connections kept open for reuse.
+        keepalive_expiry (float): seconds an idle connection is kept.
+        max_retries (int): retries after the first attempt.
+        backoff_base (float): first backoff delay in seconds, doubled on every retry.
+        backoff_max (float): maximum delay between retries, also caps retry-after.
+        hedge_after (float): seconds before a slow non streaming chat completion is hedged, None to disable. the hedge
+            needs a free slot of its own and is skipped when the deployment is at max_concurrency.
+        max_concurrency (int): maximum in flight requests per deployment.
+        acquire_timeout (float): seconds to wait for a free slot before failing with httpx.PoolTimeout.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60,
+        hedge_after: Optional[float] = None,
+        max_concurrency: int = 8,
+        acquire_timeout: float = 300,
+    ):
+        self._transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._hedges = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="llm-hedge") if hedge_after else None
+
+    def _semaphore(self, request: httpx.Request) -> threading.BoundedSemaphore:
+        match = _deployment.search(request.url.path)
+        key = f"{request.url.host}/{match.group(1)}" if match else request.url.host
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._semaphores[key]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # make sure the body can be sent more than once
+        request.read()
+        streaming = _is_streaming(request)
+
+        semaphore = self._semaphore(request)
+        if not semaphore.acquire(timeout=self.acquire_timeout):
+            raise httpx.PoolTimeout(
+                f"no free slot for {request.url.host}{request.url.path} within {self.acquire_timeout} seconds",
+                request=request,
+            )
+        try:
+            response = self._send_with_retries(request, streaming, semaphore)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        if streaming and not response.is_closed:
+            response.stream = _ReleasingStream(response.stream, semaphore.release)
+        else:
+            semaphore.release()
+        return response
+
+    def _send_with_retries(self, request: httpx.Request, streaming: bool, semaphore: threading.BoundedSemaphore) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                if streaming:
+                    response = self._transport.handle_request(request)
+                elif self.hedge_after and _is_idempotent(request):
+                    response = self._send_hedged(request, semaphore)
+                else:
+                    response = self._send_buffered(request)
+            except RETRY_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                return response
+
+            delay = _retry_after(response)
+            response.close()
+            time.sleep(min(delay, self.backoff_max) if delay is not None else self._backoff(attempt))
+            attempt += 1
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _send_buffered(self, request: httpx.Request) -> httpx.Response:
+        # read the whole (still encoded) body so the connection goes back to the pool right away
+        response = self._transport.handle_request(request)
+        try:
+            body = b"".join(response.stream)
+        finally:
+            response.close()
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=httpx.ByteStream(body),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def _send_hedged(self, request: httpx.Request, semaphore: threading.BoundedSemaphore) -> httpx.Response:
+        primary = self._hedges.submit(self._send_buffered, request)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        # the hedge is a second in flight request and needs its own slot; without one just wait for the primary
+        if not semaphore.acquire(blocking=False):
+            return primary.result()
+        hedge = self._hedges.submit(self._send_buffered, request)
+        hedge.add_done_callback(lambda _: semaphore.release())
+
+        futures = [primary, hedge]
+        while futures:
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None and (future.result().status_code < 500 or not futures):
+                    return future.result()
+                if not futures:
+                    # both attempts failed, let the retry loop handle the error
+                    return future.result()
+
+    def close(self):
+        self._transport.close()
+        if self._hedges is not None:
+            self._hedges.shutdown(wait=False)
+
+
+def _is_streaming(request: httpx.Request) -> bool:
+    if request.method != "POST" or not request.content:
+        return False
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return False
+    return isinstance(body, dict) and bool(body.get("stream"))
+
+
+def _is_idempotent(request: httpx.Request) -> bool:
+    # a chat completion has no side effect and can be sent twice
+    return request.url.path.endswith("/chat/completions")
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """
+    returns:
+        float: seconds to wait from the retry-after-ms or retry-after header, None if there is none.
+    """
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SharedClient(httpx.Client):
+    # autogen deep copies llm_config; the shared client must stay shared
+    def __deepcopy__(self, memo):
+        return self
+
+
+# process wide client used by all LLM callers. tune with environment variables
+load_dotenv()
+
+transport = LLMTransport(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+    acquire_timeout=float(os.getenv("LLM_ACQUIRE_TIMEOUT", "300")),
+    hedge_after=float(os.getenv("LLM_HEDGE_AFTER")) if os.getenv("LLM_HEDGE_AFTER") else None,
+)
+http_client = SharedClient(transport=transport, timeout=httpx.Timeout(120, connect=10))
@@ -5,7 +5,11 @@ import autogen
 import os
 from dotenv import load_dotenv  
 
+import _Transport_5
+
 import _FunctionFactory_5 as functions
+from _ToolExecutor_5 import tool_executor
+from _SessionState_5 import AgentBlobRefs
 
 
 # load llm config
@@ -17,13 +21,20 @@ config_list = [{
     'base_url': os.getenv("AZURE_OPENAI_ENDPOINT"), 
     'api_type': 'azure', 
     'api_version': os.getenv("AZURE_OPENAI_API_VERSION"),
-    'tags': ["tool", "gpt-4"]
+    'tags': ["tool", "gpt-4"],
+    # shared connection pool, retries and concurrency cap for all LLM calls, see _Transport_5.py
+    'http_client': _Transport_5.http_client,
+    'max_retries': 0,
     }]
 
 
+# stream the assistant replies to the console as tokens arrive, set AUTOGEN_STREAM=false to wait for complete replies
+stream = os.getenv("AUTOGEN_STREAM", "true").lower() == "true"
+
 llm_config={
     "config_list": config_list, 
     "timeout": 120,
+    "stream": stream,
     }
 
 
@@ -32,26 +43,36 @@ functions_dict = {item["func"].__name__: item["func"] for item in functions.func
 
 
 # in memory vector database for function lookup
+# built on first use: process pool workers re-import the main module and must not embed the functions table
 import chromadb
-
-documents = []
-metadatas = []
-ids = []
-
-# populate the documents, metadatas and ids for the functions
-for item in functions.functions_table:
-    documents.append(item["func"].__desc__)
-    metadatas.append({"name": item["func"].__name__})
-    ids.append(item["id"])
-
-# create the collection and add the documents
-client=chromadb.Client()
-collection = client.create_collection("functions")
-collection.add(
-        documents=documents, # we embed for you, or bring your own
-        metadatas=metadatas, # filter on arbitrary metadata!
-        ids=ids, # must be unique for each doc 
-)
+import threading
+
+collection = None
+_collection_lock = threading.Lock()
+
+def get_collection():
+    global collection
+    with _collection_lock:
+        if collection is None:
+            documents = []
+            metadatas = []
+            ids = []
+
+            # populate the documents, metadatas and ids for the functions
+            for item in functions.functions_table:
+                documents.append(item["func"].__desc__)
+                metadatas.append({"name": item["func"].__name__})
+                ids.append(item["id"])
+
+            # create the collection and add the documents
+            client=chromadb.Client()
+            collection = client.get_or_create_collection("functions")
+            collection.add(
+                    documents=documents, # we embed for you, or bring your own
+                    metadatas=metadatas, # filter on arbitrary metadata!
+                    ids=ids, # must be unique for each doc 
+            )
+        return collection
 
 
 # function factory to get a function based on the description. the fuction will be called by the user proxy agent
@@ -68,7 +89,7 @@ def get_function(description: str) -> Callable[..., Any]:
         Callable[..., Any]: the function.
     """
 
-    results = collection.query(
+    results = get_collection().query(
         query_texts=[description],
         n_results=1,
         # where={"metadata_field": "is_equal_to_this"}, # optional filter
@@ -98,8 +119,11 @@ def register_functions(function_description: Annotated[str, "description of the
         str: registration result
     """
     func = get_function(function_description)
-    assistant.register_for_llm(name=func.__name__, description=func.__desc__)(func)
-    user_proxy.register_for_execution(name=func.__name__)(func)
+    # thread and process functions are dispatched through the tool executor
+    func = tool_executor.wrap(func)
+    session_user_proxy, session_assistant = getattr(_session, "agents", (user_proxy, assistant))
+    session_assistant.register_for_llm(name=func.__name__, description=func.__desc__)(func)
+    session_user_proxy.register_for_execution(name=func.__name__)(func)
     return f"registering: {func.__name__} for: '{function_description}'"
 
 
@@ -122,10 +146,10 @@ import typing;
 assistant = None
 user_proxy = None
 
-def Create_Agents( ) -> typing.Tuple[autogen.UserProxyAgent, autogen.AssistantAgent]:
-    global assistant
-    global user_proxy
-    
+# agents of the chat running on the current thread, used by register_functions when several chats run concurrently
+_session = threading.local()
+
+def _create_agents( ) -> typing.Tuple[autogen.UserProxyAgent, autogen.AssistantAgent]:
     assistant = autogen.AssistantAgent(
         name="assistant",
         system_message=assistant_system_message,
@@ -149,7 +173,33 @@ def Create_Agents( ) -> typing.Tuple[autogen.UserProxyAgent, autogen.AssistantAg
     assistant.register_for_llm(name="register_functions", description=register_functions.__desc__)(register_functions)
     user_proxy.register_for_execution(name="register_functions")(register_functions)
 
+    # keep large tool outputs in the shared blob store instead of in both agents' history
+    user_proxy.blob_refs = AgentBlobRefs(user_proxy, assistant)
+
     return user_proxy, assistant
+
+
+def Create_Agents( ) -> typing.Tuple[autogen.UserProxyAgent, autogen.AssistantAgent]:
+    global assistant
+    global user_proxy
+    
+    user_proxy, assistant = _create_agents()
+    return user_proxy, assistant
+    
+
+# create agents for one chat on the current thread, e.g. a batch runner worker. 
+# functions registered during the chat only go to these agents
+def Create_Session_Agents( ) -> typing.Tuple[autogen.UserProxyAgent, autogen.AssistantAgent]:
+    session_user_proxy, session_assistant = _create_agents()
+    _session.agents = (session_user_proxy, session_assistant)
+    return session_user_proxy, session_assistant
+
+
+# release the agents of the current thread
+def End_Session():
+    agents = _session.__dict__.pop("agents", None)
+    if agents is not None:
+        agents[0].blob_refs.release()
     
     
 # reset the agents to their initial state
@@ -158,6 +208,8 @@ def Reset_Agents():
     global assistant
     
     user_proxy.clear_history()
+    assistant.clear_history()
+    user_proxy.blob_refs.release()
     user_proxy.function_map.clear()
     assistant.llm_config=llm_config
 
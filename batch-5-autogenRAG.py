@@ -0,0 +1,169 @@
+
+# run prompt files through the autogenRAG engine concurrently and write the results to a jsonl file
+#
+# usage:
+#   python batch-5-autogenRAG.py prompts/ --output results.jsonl --workers 4 --rpm 60 --tpm 40000
+#   python batch-5-autogenRAG.py prompts.jsonl --output results.jsonl
+#
+# the input is either a directory of prompt-xxx.txt style files (task id is the file name) or a jsonl file
+# with one {"id": ..., "prompt": ...} object per line. tasks that already succeeded in the output file are
+# skipped, so an interrupted run can be restarted with the same command. failed tasks are run again and their
+# new record is appended after the old one; the last record of a task is its current result.
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import _RateLimiter_5
+from _RateLimiter_5 import RateLimiter, limit_agent
+
+
+def load_tasks(source):
+    """
+    args:
+        source (str): directory of .txt prompt files or a .jsonl file.
+
+    returns:
+        list: list of {"id", "prompt"} dicts.
+    """
+    tasks = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith(".txt"):
+                with open(os.path.join(source, name), "r") as f:
+                    tasks.append({"id": name, "prompt": f.read()})
+    else:
+        with open(source, "r") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                tasks.append({"id": str(item.get("id", line_number)), "prompt": item["prompt"]})
+    return tasks
+
+
+def load_completed(output_path):
+    """
+    returns:
+        set: ids of the tasks whose last record in the results file is a success.
+    """
+    status = {}
+    if os.path.exists(output_path):
+        with open(output_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    status[record["id"]] = record.get("status")
+                except (ValueError, KeyError):
+                    # a partial last line from an interrupted run
+                    continue
+    return {task_id for task_id, task_status in status.items() if task_status == "success"}
+
+
+def _usage(chat_result):
+    # chat_result.cost: {"usage_including_cached_inference": {"total_cost": ..., "<model>": {"prompt_tokens": ...}}}
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    summary = (chat_result.cost or {}).get("usage_including_cached_inference", {})
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            for name in usage:
+                usage[name] += value.get(name, 0)
+    return usage
+
+
+def run_task(task, limiter, max_turns):
+    """
+    run one prompt with its own agents.
+
+    returns:
+        dict: the result record.
+    """
+    # imported on use, process pool workers re-import this module when they start and must stay light
+    import _autogenRAG_5 as autogenRAG
+
+    started = time.perf_counter()
+    try:
+        user_proxy, assistant = autogenRAG.Create_Session_Agents()
+
+        # wait for the rate limiter before every LLM call of the assistant, and correct it after every reply
+        limit = limit_agent(assistant, limiter)
+
+        chat_result = user_proxy.initiate_chat(
+            assistant,
+            message=task["prompt"],
+            max_turns=max_turns,
+            silent=True,
+        )
+        usage = _usage(chat_result)
+
+        history = chat_result.chat_history
+        answer = (chat_result.summary or "").replace("TERMINATE", "").strip()
+        return {
+            "id": task["id"],
+            "status": "success",
+            "answer": answer,
+            "turns": limit.replies,
+            "messages": len(history),
+            "tool_calls": sum(len(msg.get("tool_calls") or []) for msg in history),
+            "tokens": usage,
+            "latency_seconds": round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        return {
+            "id": task["id"],
+            "status": "error",
+            "error": str(e),
+            "latency_seconds": round(time.perf_counter() - started, 3),
+        }
+    finally:
+        autogenRAG.End_Session()
+
+
+def run_batch(tasks, output_path, workers=4, rpm=None, tpm=None, max_turns=12):
+    """
+    run the tasks not yet in output_path and append their results as they finish.
+    """
+    completed = load_completed(output_path)
+    pending = [task for task in tasks if task["id"] not in completed]
+    print(f"{len(tasks)} tasks, {len(tasks) - len(pending)} already done, running {len(pending)} with {workers} workers")
+
+    limiter = RateLimiter(rpm=rpm, tpm=tpm)
+    # LLM calls made inside tools share the quota
+    _RateLimiter_5.shared_limiter = limiter
+    write_lock = threading.Lock()
+
+    with open(output_path, "a") as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        # an interrupted run can leave a partial last line, start the new records on a line of their own
+        if output.tell() > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    output.write("\n")
+        futures = [executor.submit(run_task, task, limiter, max_turns) for task in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            with write_lock:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+            print(f"{result['id']}: {result['status']} in {result['latency_seconds']}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run prompts through the autogenRAG engine")
+    parser.add_argument("source", help="directory of .txt prompt files or a .jsonl file of {id, prompt}")
+    parser.add_argument("--output", default="results.jsonl", help="results jsonl file, also used to resume")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent chats")
+    parser.add_argument("--rpm", type=float, default=None, help="azure openai requests per minute quota")
+    parser.add_argument("--tpm", type=float, default=None, help="azure openai tokens per minute quota")
+    parser.add_argument("--max-turns", type=int, default=12)
+    args = parser.parse_args()
+
+    import _autogenRAG_5 as autogenRAG
+
+    # token streaming from concurrent chats would interleave on the console
+    autogenRAG.llm_config["stream"] = False
+
+    run_batch(load_tasks(args.source), args.output, args.workers, args.rpm, args.tpm, args.max_turns)
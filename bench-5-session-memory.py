@@ -0,0 +1,162 @@
+
+# memory benchmark for per session chat state
+#
+# builds N sessions that each ran the find-benefits task (system prompt, user prompt, tool calls and tool outputs
+# including the policy pdf text) and compares the memory held by:
+#   - plain message dicts vs the compact Session records from _SessionState_5.py (function_calling.py)
+#   - autogen agent histories, one dict per message in each agent, with and without AgentBlobRefs (the engine)
+#
+# usage:
+#   python bench-5-session-memory.py
+
+import gc
+import json
+import tracemalloc
+
+import _SessionState_5 as state
+
+
+SYSTEM_MESSAGE = """
+    For coding tasks, only use the functions you have been provided with.
+    do not generate answer on your own. do not guess.
+    for tasks that needs to access user local resources, do not generate python code. use the functions provided to you.
+    if you don't have enough information to execute the task, call the given 'register_functions' function with a brief description e.g. 'get insurance policy'.
+    if you need to save content to or read content from a file, call register_functions function to register functions that can save to or read from file.
+    Reply TERMINATE when the task is done.
+"""
+
+USER_MESSAGE = """
+I have a health insurance account with me as the primary policy holder (name linkai yu). I would like to find out the benefits of my policy.
+Summarize it in one paragraph, and then save the summary to a file c:\\temp\\output_benefit_summary.txt.
+ """
+
+# stand in for the policy text read_file extracts from Northwind_Standard_Benefits_Details.pdf
+POLICY_TEXT = ("Northwind Standard is a comprehensive health plan that covers medical, vision and dental services, "
+               "preventive care, prescription drugs and mental health services. ") * 40
+
+
+def _payload(text):
+    # every session gets its own copy of the tool output, as it does when read_file runs per session
+    return text.encode("utf-8").decode("utf-8")
+
+
+def conversation(session_number):
+    """
+    returns:
+        list: the messages of one find-benefits chat as chat completion dicts.
+    """
+    messages = [
+        {"role": "system", "content": _payload(SYSTEM_MESSAGE)},
+        {"role": "user", "content": _payload(USER_MESSAGE)},
+    ]
+    steps = [
+        ("register_functions", {"function_description": "get insurance policy"}, "registering: get_health_insurance_policy"),
+        ("get_health_insurance_account", {"user": "linkai yu"}, "A12345"),
+        ("get_health_insurance_policy", {"account": "A12345"}, "P56789"),
+        ("get_policy_benefits", {"policy": "P56789"}, POLICY_TEXT),
+        ("read_file", {"file_path": "Northwind_Standard_Benefits_Details.pdf"}, POLICY_TEXT),
+        ("save_to_file", {"file_path": "c:\\temp\\output_benefit_summary.txt", "content": "summary"}, "success: write id w1"),
+    ]
+    for i, (name, args, output) in enumerate(steps):
+        call_id = f"call_{session_number}_{i}"
+        messages.append({
+            "role": _payload("assistant"),
+            "content": None,
+            "tool_calls": [{"id": call_id, "type": "function", "function": {"name": _payload(name), "arguments": json.dumps(args)}}],
+        })
+        messages.append({"role": _payload("tool"), "name": _payload(name), "tool_call_id": call_id, "content": _payload(output)})
+    messages.append({"role": "assistant", "content": _payload("the policy covers ... TERMINATE")})
+    return messages
+
+
+def measure(build, sessions):
+    """
+    returns:
+        int: bytes allocated by the sessions built by build.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    held = [build(i) for i in range(sessions)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    for item in held:
+        if hasattr(item, "release"):
+            item.release()
+    del held
+    gc.collect()
+    return size
+
+
+def build_dicts(i):
+    return conversation(i)
+
+
+def build_session(i):
+    # the dicts are only the input here, what stays alive is the Session
+    return state.Session.from_messages(conversation(i), session_id=str(i))
+
+
+class _Agent:
+    # stands in for an autogen agent, the benchmark calls the hooks directly
+    def register_hook(self, hookable_method, hook):
+        pass
+
+
+class EngineChat:
+    """
+    the chat history autogen keeps for one session: the user proxy and the assistant each store their own dict
+    per message, and tool results carry their output in content and in tool_responses.
+    """
+
+    def __init__(self, session_number, blob_refs=False):
+        self.refs = state.AgentBlobRefs(_Agent(), _Agent()) if blob_refs else None
+        messages = []
+        for message in conversation(session_number):
+            if message["role"] == "tool":
+                message = {
+                    "role": "tool",
+                    "content": message["content"],
+                    "tool_responses": [{"tool_call_id": message["tool_call_id"], "role": "tool", "content": message["content"]}],
+                }
+                if self.refs is not None:
+                    message = self.refs._before_send(None, message, None, True)
+            messages.append(message)
+        self.user_proxy_history = [dict(message) for message in messages]
+        self.assistant_history = [dict(message) for message in messages]
+
+    def release(self):
+        if self.refs is not None:
+            self.refs.release()
+
+
+def build_engine(i):
+    return EngineChat(i)
+
+
+def build_engine_refs(i):
+    return EngineChat(i, blob_refs=True)
+
+
+def report(title, baseline_name, baseline, compact_name, compact):
+    print(title)
+    print(f"{'sessions':>10} {baseline_name + ' KB':>14} {compact_name + ' KB':>14} {'per session':>22} {'saved':>8}")
+    for sessions in (100, 1000):
+        before = measure(baseline, sessions)
+        after = measure(compact, sessions)
+        per_session = f"{before / sessions / 1024:.1f} -> {after / sessions / 1024:.1f} KB"
+        print(f"{sessions:>10} {before / 1024:>14.0f} {after / 1024:>14.0f} {per_session:>22} {1 - after / before:>8.0%}")
+    print()
+
+
+if __name__ == "__main__":
+    report("function_calling.py history", "dicts", build_dicts, "Session", build_session)
+    report("autogen engine history", "agents", build_engine, "blob refs", build_engine_refs)
+
+    # the assistant sends the full tool output to the LLM
+    chat = EngineChat(0, blob_refs=True)
+    expanded = chat.refs._before_reply(chat.assistant_history)
+    assert [m["content"] for m in expanded] == [m["content"] for m in EngineChat(0).assistant_history]
+    chat.release()
+    print(f"blob store after benchmark: {len(state.blob_store)} blobs")
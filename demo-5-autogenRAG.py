@@ -1,24 +1,25 @@
-import autogen
-import _autogenRAG_5 as autogenRAG
+# the engine is imported under the guard because process pool workers re-import this module when they start
+if __name__ == "__main__":
+    import _autogenRAG_5 as autogenRAG
 
-user_proxy, assistant = autogenRAG.Create_Agents()
+    user_proxy, assistant = autogenRAG.Create_Agents()
 
-# take user input prompt and call the assistant
-while True:
+    # take user input prompt and call the assistant
+    while True:
     
-    user_input = input("Enter your input: ")
-    if user_input == "exit":
-        break
+        user_input = input("Enter your input: ")
+        if user_input == "exit":
+            break
 
-    chat_result = user_proxy.initiate_chat(
-        assistant, 
-        message=user_input,  
-        max_turns=12,
-    )
+        chat_result = user_proxy.initiate_chat(
+            assistant, 
+            message=user_input,  
+            max_turns=12,
+        )
 
-    print("chat complete")
+        print("chat complete")
     
-    autogenRAG.Reset_Agents()
+        autogenRAG.Reset_Agents()
     
     
     
@@ -9,6 +9,9 @@
 import function_utils as function_utils
 from typing_extensions import Annotated
 import _FunctionFactory_5 as functions
+from _ToolExecutor_5 import tool_executor
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
 
 functions_dict = {item["func"].__name__: item["func"] for item in functions.functions_table}
 
@@ -42,26 +45,36 @@ def check_args(function, args):
 
 
 # in memory vector database for function lookup
+# built on first use: process pool workers re-import the main module and must not embed the functions table
 import chromadb
-
-documents = []
-metadatas = []
-ids = []
-
-# populate the documents, metadatas and ids for the functions
-for item in functions.functions_table:
-    documents.append(item["func"].__desc__)
-    metadatas.append({"name": item["func"].__name__})
-    ids.append(item["id"])
-
-# create the collection and add the documents
-client=chromadb.Client()
-collection = client.create_collection("functions")
-collection.add(
-        documents=documents, # we embed for you, or bring your own
-        metadatas=metadatas, # filter on arbitrary metadata!
-        ids=ids, # must be unique for each doc 
-)
+import threading
+
+collection = None
+_collection_lock = threading.Lock()
+
+def get_collection():
+    global collection
+    with _collection_lock:
+        if collection is None:
+            documents = []
+            metadatas = []
+            ids = []
+
+            # populate the documents, metadatas and ids for the functions
+            for item in functions.functions_table:
+                documents.append(item["func"].__desc__)
+                metadatas.append({"name": item["func"].__name__})
+                ids.append(item["id"])
+
+            # create the collection and add the documents
+            client=chromadb.Client()
+            collection = client.get_or_create_collection("functions")
+            collection.add(
+                    documents=documents, # we embed for you, or bring your own
+                    metadatas=metadatas, # filter on arbitrary metadata!
+                    ids=ids, # must be unique for each doc 
+            )
+        return collection
 
 
 # function factory to get a function based on the description. the fuction will be called by the user proxy agent
@@ -78,7 +91,7 @@ def get_function(description: str) -> Callable[..., Any]:
         Callable[..., Any]: the function.
     """
 
-    results = collection.query(
+    results = get_collection().query(
         query_texts=[description],
         n_results=1,
         # where={"metadata_field": "is_equal_to_this"}, # optional filter
@@ -131,75 +144,207 @@ assistant_system_message = """
     Reply TERMINATE when the task is done.
 """
 
-messages = [
-            {"role": "system", "content": assistant_system_message },
-            {"role": "user", "content": user_message }
-        ]
+# chat history kept as compact records, large tool outputs are stored once in the shared blob store
+from _SessionState_5 import Session
+
+messages = Session()
+messages.add("system", assistant_system_message)
+messages.add("user", user_message)
 
 
 from dotenv import load_dotenv
 import os
 from openai import AzureOpenAI
+import _Transport_5
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
 openai = AzureOpenAI(
   azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
   api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-  api_version="2024-05-01-preview"
+  api_version="2024-05-01-preview",
+  # shared connection pool, retries and concurrency cap for all LLM calls, see _Transport_5.py
+  http_client=_Transport_5.http_client,
+  max_retries=0,
 )
 
+# metrics of the last chat completion call: time to first token of each request (streaming only),
+# full latency of each request, and the total time
+metrics = {}
+
 # this uses chat completion function calling feature
-def call_OpenAI_using_chat_completion(messages, tools, available_functions):
+def call_OpenAI_using_chat_completion(messages, tools, available_functions, stream=False):
     # Step 1: send the prompt and available functions to GPT
+    # when stream is True, tokens are printed as they arrive and tool calls start as soon as their arguments are complete
+    # messages is a Session, a list of message dicts is converted to one
+    if not isinstance(messages, Session):
+        messages = Session.from_messages(messages)
     
-    while True:
-        response = openai.chat.completions.create (
-            model="gpt-4",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-        )
+    metrics.clear()
+    metrics.update({"requests": 0, "time_to_first_token": [], "request_seconds": [], "total_seconds": 0.0})
+    started = time.perf_counter()
 
-        response_message = response.choices[0].message
-        messages.append(response_message)
+    while True:
+        request_started = time.perf_counter()
+        if stream:
+            response_message, tool_results = _stream_chat_completion(messages, tools, available_functions)
+            messages.add_message(response_message)
+            content = response_message["content"]
+            tool_calls = response_message.get("tool_calls")
+        else:
+            response = openai.chat.completions.create (
+                model="gpt-4",
+                messages=messages.to_openai(),
+                tools=tools,
+                tool_choice="auto",
+            )
+
+            response_message = response.choices[0].message
+            messages.add_message(response_message)
+            content = response_message.content
+            tool_calls = response_message.tool_calls
+            tool_results = None
+        metrics["request_seconds"].append(time.perf_counter() - request_started)
+        metrics["requests"] += 1
 
         # handle function call
         # code ref: https://learn.microsoft.com/en-us/azure/ai-services/openai/how-to/function-calling
 
-        if not response_message.tool_calls:
+        if not tool_calls:
             break
         else:
-            for tool_call in response_message.tool_calls:
-                print(f"Recommended Function call: {tool_call}")
-                print()
-
-                # call the function
-                # Note: the JSON response may not always be valid; be sure to handle errors
-                function_name = tool_call.function.name
-
-                # verify function exists
-                if function_name not in available_functions:
-                    return "Function " + function_name + " does not exist"
-                function_to_call = available_functions[function_name]
-
-                # verify function has correct number of arguments
-                function_args = json.loads(tool_call.function.arguments)
-                if check_args(function_to_call, function_args) is False:
-                    return "Invalid number of arguments for function: " + function_name
-                # call the function
-                function_response = function_to_call(**function_args)
+            for tool_call in tool_calls:
+                if stream:
+                    tool_call_id = tool_call["id"]
+                    function_name = tool_call["function"]["name"]
+                    error, function_response = tool_results[tool_call_id].result()
+                else:
+                    print(f"Recommended Function call: {tool_call}")
+                    print()
+                    tool_call_id = tool_call.id
+                    function_name = tool_call.function.name
+                    error, function_response = _call_function(function_name, tool_call.function.arguments, available_functions)
+
+                if error:
+                    metrics["total_seconds"] = time.perf_counter() - started
+                    return error
                 print(f"Output of function call: {function_response}")
                 print()
-                messages.append({
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": function_response,
-                    })
+                messages.add_tool_result(tool_call_id, function_name, function_response)
                 
-    return response.choices[0].message.content
+    metrics["total_seconds"] = time.perf_counter() - started
+    return content
+
+
+# call one function requested by the model. returns (error, function_response)
+def _call_function(function_name, arguments, available_functions):
+    # verify function exists
+    if function_name not in available_functions:
+        return "Function " + function_name + " does not exist", None
+    function_to_call = available_functions[function_name]
+
+    # verify function has correct number of arguments
+    # Note: the JSON response may not always be valid; be sure to handle errors
+    function_args = json.loads(arguments)
+    if check_args(function_to_call, function_args) is False:
+        return "Invalid number of arguments for function: " + function_name, None
+    # call the function, thread and process functions are dispatched through the tool executor
+    try:
+        return None, tool_executor.call(function_to_call, function_args)
+    except (TimeoutError, BrokenProcessPool, CancelledError) as e:
+        return None, f"Error: {e or type(e).__name__}"
+
+
+# tool calls requested by the model run here while the rest of the response is still streaming
+stream_tool_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool-call")
+
+def _stream_chat_completion(messages, tools, available_functions):
+    """
+    send one streaming chat completion request, print the reply tokens as they arrive and assemble the tool calls.
+    each tool call is submitted to stream_tool_pool as soon as its arguments are complete, i.e. when the model
+    moves on to the next tool call or finishes the response.
+
+    args:
+        messages (Session): the chat messages.
+        tools (list): the tools schema.
+        available_functions (dict): function name to function.
+
+    returns:
+        tuple: the assistant message as a dict, and a dict of tool call id to future of (error, function_response).
+    """
+    request_started = time.perf_counter()
+    response = openai.chat.completions.create (
+        model="gpt-4",
+        messages=messages.to_openai(),
+        tools=tools,
+        tool_choice="auto",
+        stream=True,
+    )
+
+    content = []
+    tool_calls = {}    # index -> {"id", "type", "function": {"name", "arguments"}}
+    tool_results = {}  # tool call id -> future
+    first_token = True
+
+    def start_tool_call(index):
+        tool_call = tool_calls[index]
+        if tool_call["id"] in tool_results:
+            return
+        print(f"Recommended Function call: {tool_call}")
+        print()
+        tool_results[tool_call["id"]] = stream_tool_pool.submit(
+            _call_function, tool_call["function"]["name"], tool_call["function"]["arguments"], available_functions)
+
+    # close the stream even when we stop reading at finish_reason, the shared transport frees the
+    # deployment slot only when the response is closed
+    try:
+        for chunk in response:
+            # azure sends a first chunk with the content filter results and no choices
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if first_token and (delta.content or delta.tool_calls):
+                first_token = False
+                metrics["time_to_first_token"].append(time.perf_counter() - request_started)
+
+            if delta.content:
+                content.append(delta.content)
+                print(delta.content, end="", flush=True)
+
+            for tool_call_delta in delta.tool_calls or []:
+                index = tool_call_delta.index
+                if index not in tool_calls:
+                    # the model streams tool calls one after another, so a new index completes the previous ones
+                    for previous in tool_calls:
+                        start_tool_call(previous)
+                    tool_calls[index] = {"id": tool_call_delta.id, "type": "function", "function": {"name": "", "arguments": ""}}
+                tool_call = tool_calls[index]
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function is not None:
+                    if tool_call_delta.function.name:
+                        tool_call["function"]["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call["function"]["arguments"] += tool_call_delta.function.arguments
+
+            if chunk.choices[0].finish_reason is not None:
+                break
+    finally:
+        response.close()
+
+    if content:
+        print()
+    for index in tool_calls:
+        start_tool_call(index)
+
+    response_message = {"role": "assistant", "content": "".join(content) or None}
+    if tool_calls:
+        response_message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    return response_message, tool_results
 
 import time        
 
@@ -309,6 +454,7 @@ def call_OpenAI_using_assistant_function_calling(user_message, system_messages,
 
 
 if __name__ == "__main__":
-    call_OpenAI_using_chat_completion(messages, tools, function_map)
+    call_OpenAI_using_chat_completion(messages, tools, function_map, stream=True)
+    print(f"metrics: {metrics}")
     # call_OpenAI_using_assistant_function_calling(user_message, assistant_system_message, tools, function_map)
     print("done")